@@ -1,3 +1,4 @@
+import argparse
 import os
 
 from slides_ingest.ingest_slides import SlidesIngest
@@ -5,10 +6,16 @@ from slides_ingest.ingest_slides import SlidesIngest
 if __name__ == '__main__':
     os.environ["TOKENIZERS_PARALLELISM"] = 'false'
 
-    slides = SlidesIngest(pp_filename='8a815e94056b8572942ec6bfb545d78bweek_1_friday_400hsc_block_2.pptx')
-    
-    slides.runner(
-        save=False, 
-        display=True
-        )
-    
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Summarise PowerPoint decks')
+    parser.add_argument('files', nargs='+', help='PowerPoint filenames to summarise')
+    parser.add_argument('--save', action='store_true', help='Save the summarisation to a file')
+    parser.add_argument('--no-display', action='store_true', help='Do not display the summarisation in the console')
+    args = parser.parse_args()
+
+    for pp_filename in args.files:
+        slides = SlidesIngest(pp_filename=pp_filename)
+
+        slides.runner(
+            save=args.save,
+            display=not args.no_display
+            )
@@ -1,41 +1,149 @@
+import functools
+import hashlib
+import json
 import logging
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Optional, Tuple, Union
+from typing import Iterator, List, Optional, Tuple, Union
 
+import numpy as np
 import pandas as pd
+import torch
 from pptx import Presentation
+from pptx.enum.shapes import MSO_SHAPE_TYPE
 from tqdm import tqdm
 
-from transformers import pipeline
+from transformers import AutoTokenizer, pipeline
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    from optimum.onnxruntime import ORTModelForSeq2SeqLM
+except ImportError:
+    ORTModelForSeq2SeqLM = None
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 log = logging.getLogger()
 
+REFERENCES_PATTERNS = [
+    r'[A-Za-z]+ and [A-Za-z]+ \(\d{4}\)',   # Name and Name (yyyy)
+    r'\([A-Za-z]+ and [A-Za-z]+, \d{4}\)',  # (Name and Name, yyyy)
+    r'[A-Za-z]+ et al\. \(\d{4}\)',         # Name et al. (yyyy)
+    r'\([A-Za-z]+ et al\., \d{4}\)',        # (Name et al., yyyy)
+    r'[A-Za-z]+ \(\d{4}\)',                 # Name (yyyy)
+    r'\([A-Za-z]+, \d{4}\)',                # (Name, yyyy)
+]
+
+# Compiled once so every deck is scanned in a single pass over the text
+REFERENCES_RE = re.compile('|'.join(f'(?:{pattern})' for pattern in REFERENCES_PATTERNS))
+
+# Slide separator for the contiguous corpus; \x1f cannot appear in a reference
+CORPUS_SEP = '\n\x1f\n'
+
+# Sentence boundaries on terminal punctuation, unlike a bare '. ' split
+SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?])\s+')
+
+@functools.lru_cache(maxsize=4)
+def _get_summariser(model_name, device, dtype, batch_size):
+    """
+    Function to build the summarisation pipeline, cached so repeated
+    SlidesIngest instances in one process reuse the loaded model
+    :param model_name: hugging face model id
+    :param device: torch device for inference
+    :param dtype: torch dtype for the model weights
+    :param batch_size: pipeline-level batch size for list inputs
+    :return: summarisation pipeline
+    """
+    # AOT-compiled inference via ONNX Runtime when optimum is installed; CPU only,
+    # so the tuned CUDA/MPS torch path is never preempted
+    if ORTModelForSeq2SeqLM is not None and device == -1:
+        onnx_dir = os.path.join(
+            os.path.expanduser('~'), '.cache', 'slides_chat', f'onnx_{model_name.replace("/", "_")}'
+            )
+
+        if os.path.isdir(onnx_dir):
+            log.info(f'Loading cached ONNX Runtime export: {onnx_dir}')
+            ort_model = ORTModelForSeq2SeqLM.from_pretrained(onnx_dir)
+        else:
+            # Export once and persist so later processes skip the conversion
+            log.info(f'Exporting summariser to ONNX Runtime: {onnx_dir}')
+            ort_model = ORTModelForSeq2SeqLM.from_pretrained(model_name, export=True)
+            ort_model.save_pretrained(onnx_dir)
+
+        return pipeline(
+            'summarization',
+            model=ort_model,
+            tokenizer=AutoTokenizer.from_pretrained(model_name),
+            batch_size=batch_size
+            )
+
+    summariser = pipeline(
+        'summarization',
+        model=model_name,
+        device=device,
+        torch_dtype=dtype,
+        batch_size=batch_size,
+        model_kwargs={'low_cpu_mem_usage': True}
+        )
+
+    if hasattr(torch, 'compile'):
+        # Compile forward in place: generate() resolves through the original module,
+        # so rebinding the model itself would leave the compiled graph unused
+        summariser.model.forward = torch.compile(summariser.model.forward, mode='reduce-overhead', fullgraph=False)
+
+    return summariser
+
 class SlidesIngest:
     """
     Class for PowerPoint slides content ingesting and summarisation
     """
     def __init__(
-        self, 
-        pp_filename: str
+        self,
+        pp_filename: str,
+        model_name: str = 'sshleifer/distilbart-cnn-12-6',
+        batch_size: int = 8,
+        num_beams: int = 1,
+        no_repeat_ngram_size: int = 3,
+        early_stopping: bool = False
         ):
         """
         :param pp_filename: PowerPoint file location
+        :param model_name: hugging face summarisation model id
+        :param batch_size: number of chunks per batched summarisation call, tunable per hardware
+        :param num_beams: beam count for chunk summarisation; 1 keeps decoding greedy
+        :param no_repeat_ngram_size: n-gram repetition block size during generation
+        :param early_stopping: stop beam search early once beams finish; ignored when greedy
         """
         self.pp_filename = pp_filename
-        
+        self.batch_size = batch_size
+        self.num_beams = num_beams
+        self.no_repeat_ngram_size = no_repeat_ngram_size
+        self.early_stopping = early_stopping
+
         self.base_path = '/Users/ansonliu/Downloads'
         self.filepath = os.path.join(self.base_path, self.pp_filename)
         self.today = datetime.today().strftime('%d-%m-%Y')
-        
+
+        self.model_name = model_name
+        self.cache_path = os.path.join(os.path.expanduser('~'), '.cache', 'slides_chat', 'summaries.json')
+        self._sum_cache = None
+
         self.long_sum = None
+        self.tokenizer = None
+        self.gen_kwargs = None
         
         self.prs = None
         self.all_slides_text = None
         self.slide_content = None
+        self._n_slides = None
+        self._corpus = None
+        self._slide_offsets = None
         self.slide_summary = None
 
         self.references_df = None
@@ -45,10 +153,72 @@ class SlidesIngest:
         Function to initialise all summariser tools
         """
         log.info('Initialisiing hugging face summary tools')
-        
-        # self.long_sum = pipeline("summarization", model="sshleifer/distilbart-cnn-12-6")
-        self.long_sum = pipeline('summarization', model='facebook/bart-large-cnn')
+
+        if torch.cuda.is_available():
+            device = 0
+            # BF16 has fp32's range, so it is the safer half precision on Ampere+
+            dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+        elif torch.backends.mps.is_available():
+            device = 'mps'
+            dtype = torch.float16
+        else:
+            device = -1
+            # BF16 halves bytes moved per step; only worthwhile with native support
+            dtype = torch.bfloat16 if torch.backends.cpu.get_cpu_capability() == 'AVX512' else None
+
+        if device == 0:
+            # TF32 matmuls on Ampere+ at negligible precision cost
+            torch.backends.cuda.matmul.allow_tf32 = True
+        elif device == -1:
+            torch.set_num_threads(os.cpu_count())
+
+        log.info(f'Running summariser on device: {device}, dtype: {dtype}')
+
+        self.long_sum = _get_summariser(self.model_name, device, dtype, self.batch_size)
+        self.tokenizer = self.long_sum.tokenizer
+
+        # Built once and reused by every generation call
+        self.gen_kwargs = dict(
+            do_sample=False,
+            num_beams=self.num_beams,
+            no_repeat_ngram_size=self.no_repeat_ngram_size,
+            early_stopping=self.early_stopping,
+            use_cache=True
+            )
+        # BART's real context limit; guards against checkpoints shipping a larger default
+        self.tokenizer.model_max_length = 1024
     
+    def load_sum_cache(self) -> None:
+        """
+        Function to load previously computed summaries from the cache file
+        """
+        self._sum_cache = {}
+
+        if os.path.exists(self.cache_path):
+            log.info(f'Loading summary cache: {self.cache_path}')
+            with open(self.cache_path) as cache_file:
+                self._sum_cache = json.load(cache_file)
+
+    def save_sum_cache(self) -> None:
+        """
+        Function to save computed summaries to the cache file
+        """
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+
+        with open(self.cache_path, 'w') as cache_file:
+            json.dump(self._sum_cache, cache_file)
+
+    def sum_cache_key(
+        self,
+        text: str
+    ) -> str:
+        """
+        Function to build the cache key for a piece of text
+        :param text: input text to be summarised
+        :return: cache key, keyed by model and content
+        """
+        return hashlib.sha256((self.model_name + text).encode()).hexdigest()
+
     @staticmethod
     def calc_min_max_tokens(
         input_length: int
@@ -58,8 +228,8 @@ class SlidesIngest:
         :param input_length: numbers of words in string
         :return: min and max token values
         """
-        min_length = max(1, int(input_length * 0.1))
-        max_length = max(5, min(input_length // 1.25, 200))
+        min_length = max(1, input_length // 10)
+        max_length = max(5, min((input_length * 4) // 5, 200))
 
         return min_length, max_length
 
@@ -69,20 +239,50 @@ class SlidesIngest:
         """
         log.info(f'Loading PowerPoint file: {self.filepath}')
         
-        self.slide_content = {}
         self.prs = Presentation(self.filepath)
 
         log.info(f'PowerPoint total slide count: {len(self.prs.slides)}')
-        
-        for slide_num, slide in enumerate(self.prs.slides, start=0):
-            slide_text = []
-            for shape in slide.shapes:
-                if hasattr(shape, 'text') and shape.text.strip():
-                    slide_text.append(shape.text)
-            
-            self.slide_content[slide_num] = " ".join(slide_text) if slide_text else ""
 
-        log.info(f'Successfully extracted content from {len(self.slide_content)} slides.')
+        # List indexed by slide number; lxml releases the GIL so slides parse in parallel
+        slides = list(self.prs.slides)
+
+        if len(slides) < 4:
+            # Thread startup outweighs the parse cost on tiny decks
+            self.slide_content = [self.extract_slide_text(slide) for slide in slides]
+        else:
+            with ThreadPoolExecutor(max_workers=min(8, len(slides))) as executor:
+                self.slide_content = list(executor.map(self.extract_slide_text, slides))
+
+        # Contiguous corpus plus offsets mapping any match position back to its slide
+        self._corpus = CORPUS_SEP.join(self.slide_content)
+        self._slide_offsets = np.cumsum([0] + [len(text) + len(CORPUS_SEP) for text in self.slide_content])
+
+        self._n_slides = len(self.slide_content)
+
+        log.info(f'Successfully extracted content from {self._n_slides} slides.')
+
+    @classmethod
+    def extract_slide_text(cls, slide) -> str:
+        """
+        Function to extract and join all shape text on a single slide
+        :param slide: python-pptx slide object
+        :return: joined shape text for the slide
+        """
+        return " ".join(cls.walk_shape_text(slide.shapes))
+
+    @classmethod
+    def walk_shape_text(cls, shapes) -> Iterator[str]:
+        """
+        Function to yield text from shapes, recursing into grouped shapes
+        :param shapes: iterable of python-pptx shape objects
+        :return: generator of non-empty shape text
+        """
+        for shape in shapes:
+            if shape.shape_type == MSO_SHAPE_TYPE.GROUP:
+                yield from cls.walk_shape_text(shape.shapes)
+            # has_text_frame is a plain attribute, cheaper than hasattr's descriptor probe
+            elif shape.has_text_frame and (text := shape.text_frame.text).strip():
+                yield text
 
     def get_slide_text(
         self,
@@ -96,29 +296,50 @@ class SlidesIngest:
         :return all_slide_text: text from slide
         """
         log.info(f'Getting{" all " if n_slides is None else " "}slide text{f"" if n_slides is None else " in slides {n_slides}"}')
-        
-        all_slides = True if n_slides is None else False
-        
-        n_slides = n_slides if n_slides else [n for n in range(len(self.prs.slides))]
-        n_slides = [n_slides] if isinstance(n_slides, int) else n_slides
 
-        all_slide_text = f'. '.join([f'{f"Slide {n + 1}: " if slide_mapped else ""} {self.slide_content[n]}' for n in n_slides if self.slide_content[n]])
+        return f'. '.join(self.iter_slide_text(slide_mapped=slide_mapped, n_slides=n_slides))
 
-        return all_slide_text
+    def iter_slide_text(
+        self,
+        slide_mapped: bool,
+        n_slides: Optional[Union[int, List[int]]] = None
+    ) -> Iterator[str]:
+        """
+        Function to lazily yield text from all or a specific set of slides
+        :param slide_mapped: Option to show which summary is from which slide
+        :param n_slides: slide selection range, if None will get all
+        :return: generator of per-slide text
+        """
+        n_slides = n_slides if n_slides else range(self._n_slides)
+        n_slides = [n_slides] if isinstance(n_slides, int) else n_slides
 
-    @staticmethod
-    def split_text_chunks(
-        text: str, 
-        max_token_length: int = 200
-        ) -> List[str]:
+        # Specialised loops keep the slide_mapped branch and double indexing out of each iteration
+        if slide_mapped:
+            for n in n_slides:
+                if text := self.slide_content[n]:
+                    yield f'Slide {n + 1}:  {text}'
+        else:
+            for n in n_slides:
+                if text := self.slide_content[n]:
+                    yield f' {text}'
+
+    def chunk_by_tokens(
+        self,
+        token_ids: List[int],
+        max_tokens: int = 1000
+    ) -> List[str]:
         """
-        Splits text into chunks that do not exceed the model's maximum token limit.
-        :param text: Input text to split
-        :param max_token_length: Token limit per chunk
-        :return: List of text chunks
+        Function to split tokenised text into chunks on real tokenizer boundaries.
+        BART's limit is 1024 subword tokens, so chunking on whitespace words
+        both under-fills the context and forces silent truncation.
+        :param token_ids: token ids for the full text, without special tokens
+        :param max_tokens: token limit per chunk, leaving room for BOS/EOS
+        :return: list of text chunks
         """
-        words = text.split()
-        return [" ".join(words[i:i + max_token_length]) for i in range(0, len(words), max_token_length)]
+        return [
+            self.tokenizer.decode(token_ids[i:i + max_tokens], skip_special_tokens=True)
+            for i in range(0, len(token_ids), max_tokens)
+        ]
 
     def summarise_all(self) -> None:
         """
@@ -127,42 +348,103 @@ class SlidesIngest:
         log.info('Summarising all slides')
 
         self.all_slides_text = self.get_slide_text(slide_mapped=False)
-        input_length = len(self.all_slides_text.split())
+
+        # Tokenise the full text once; all length checks are in real tokens
+        all_token_ids = self.tokenizer(self.all_slides_text, add_special_tokens=False).input_ids
+        input_length = len(all_token_ids)
+
+        if input_length <= 40:
+            # Already summary-sized; the model would be pure overhead
+            log.info('Deck text is already short, skipping summarisation')
+            self.slide_summary = self.all_slides_text
+            return
 
         # Check if text exceeds token limit
-        if input_length > 200:
+        if input_length > 1000:
             log.info("Splitting text into smaller chunks due to token limit")
-            text_chunks = self.split_text_chunks(self.all_slides_text)
-            chunk_summaries = []
-            
-            n_chunk = 1
-
-            for chunk in tqdm(text_chunks, leave=True):
-                log.info(f'Summarising chunk {n_chunk} of total {len(text_chunks)}')
-                n_chunk += 1
-                
-                min_length, max_length = self.calc_min_max_tokens(input_length=len(chunk.split()))
-                summary = self.long_sum(
-                    chunk,
-                    max_length=max_length,
-                    min_length=min_length,
-                    do_sample=False
-                )[0]['summary_text']
-                chunk_summaries.append(summary)
-            
+            text_chunks = self.chunk_by_tokens(all_token_ids)
+            chunk_token_counts = [min(1000, input_length - n * 1000) for n in range(len(text_chunks))]
+
+            cache_keys = [self.sum_cache_key(chunk) for chunk in text_chunks]
+            chunk_summaries = [self._sum_cache.get(key) for key in cache_keys]
+
+            # Near-empty trailing chunks pass through unsummarised
+            for n, summary in enumerate(chunk_summaries):
+                if summary is None and chunk_token_counts[n] < 40:
+                    chunk_summaries[n] = text_chunks[n]
+
+            # Duplicate chunks (boilerplate slides) are computed once and fanned back out
+            seen_keys = set()
+            to_compute = []
+            for n, summary in enumerate(chunk_summaries):
+                if summary is None and cache_keys[n] not in seen_keys:
+                    seen_keys.add(cache_keys[n])
+                    to_compute.append(n)
+
+            log.info(f'Summarising {len(to_compute)} of {len(text_chunks)} chunks ({len(text_chunks) - len(to_compute)} cached)')
+
+            if to_compute:
+                # Sorting by length before batching keeps padding per batch minimal
+                to_compute.sort(key=lambda n: chunk_token_counts[n])
+
+                buckets = [
+                    to_compute[start:start + self.batch_size]
+                    for start in range(0, len(to_compute), self.batch_size)
+                ]
+
+                for bucket in tqdm(buckets, leave=True):
+                    bucket_lengths = [chunk_token_counts[n] for n in bucket]
+                    min_length, _ = self.calc_min_max_tokens(input_length=min(bucket_lengths))
+                    _, max_length = self.calc_min_max_tokens(input_length=max(bucket_lengths))
+
+                    with torch.inference_mode():
+                        # Greedy decoding: chunk pre-summaries don't warrant 4x beam cost
+                        summaries = self.long_sum(
+                            [text_chunks[n] for n in bucket],
+                            max_length=max_length,
+                            min_length=min_length,
+                            batch_size=self.batch_size,
+                            truncation=True,
+                            **self.gen_kwargs
+                        )
+
+                    for n, summary in zip(bucket, summaries):
+                        chunk_summaries[n] = summary['summary_text']
+                        self._sum_cache[cache_keys[n]] = chunk_summaries[n]
+
+                self.save_sum_cache()
+
+                # Fan computed summaries back out to any duplicate chunks
+                chunk_summaries = [
+                    summary if summary is not None else self._sum_cache[key]
+                    for summary, key in zip(chunk_summaries, cache_keys)
+                ]
+
             combined_text = " ".join(chunk_summaries)
-            
+
             self.slide_summary = combined_text
         else:
             # Summarize directly if within token limit
+            cache_key = self.sum_cache_key(self.all_slides_text)
+
+            if cache_key in self._sum_cache:
+                log.info('Summary served from cache')
+                self.slide_summary = self._sum_cache[cache_key]
+                return
+
             min_length, max_length = self.calc_min_max_tokens(input_length=input_length)
-            pp_summary = self.long_sum(
-                self.all_slides_text,
-                max_length=max_length,
-                min_length=min_length,
-                do_sample=False
-            )
-            self.slide_summary['all'] = pp_summary[0]['summary_text']
+            with torch.inference_mode():
+                pp_summary = self.long_sum(
+                    self.all_slides_text,
+                    max_length=max_length,
+                    min_length=min_length,
+                    truncation=True,
+                    **self.gen_kwargs
+                )
+            self.slide_summary = pp_summary[0]['summary_text']
+
+            self._sum_cache[cache_key] = self.slide_summary
+            self.save_sum_cache()
     
     def get_references(self) -> None:
         """
@@ -170,46 +452,58 @@ class SlidesIngest:
         """
         log.info('Extracting references')
 
-        references_patterns = [
-            r'([A-Za-z]+ \(\d{4}\))',                 # Name (yyyy)
-            r'(\([A-Za-z]+, \d{4}\))',                # (Name, yyyy)
-            r'([A-Za-z]+ and [A-Za-z]+ \(\d{4}\))',   # Name and Name (yyyy)
-            r'(\([A-Za-z]+ and [A-Za-z]+, \d{4}\))',  # (Name and Name, yyyy)
-            r'([A-Za-z]+ et al\., \(\d{4}\))',        # Name et al. (yyyy)
-            r'(A-Za-z]+ et al\., yyyy)\)'             # (Name et al., yyyy)
-        ]
-        
-        self.references_df = pd.DataFrame(columns=['References', 'Slide'])
-        
-        for pattern in references_patterns:
-            references = re.findall(pattern, self.all_slides_text)
-            
-            if references:
-                self.format_references(references) 
-        
-        self.references_df = self.references_df.sort_values(by=['References', 'Slide']).drop_duplicates().reset_index(drop=True)
+        rows = []
+        references = REFERENCES_RE.findall(self.all_slides_text)
+
+        if references:
+            self.format_references(references, rows)
+
+        # set + timsort dedupes and orders the tuples before pandas ever sees them
+        self.references_df = pd.DataFrame(sorted(set(rows)), columns=['References', 'Slide'])
 
-    def format_references(self, references: List[str]) -> None:
+    def format_references(
+        self,
+        references: List[str],
+        rows: List[Tuple[str, Union[int, str]]]
+    ) -> None:
         """
         Function to format references and locate which slide it was presented
         :param references: list of references found
+        :param rows: accumulator of reference/slide rows, built into a DataFrame once all patterns are processed
         """
-        for reference in references:
-            for slide_n, slide_text in self.slide_content.items():
-                if reference in slide_text:
-                    self.references_df = pd.concat([self.references_df, pd.DataFrame({'Slide': [slide_n], 'References': [reference]})], ignore_index=True).reset_index(drop=True)
-            
-            if reference not in self.references_df['References'].unique():
-                self.references_df = pd.concat([self.references_df, pd.DataFrame({'Slide': ['No slide number found'], 'References': [reference]})], ignore_index=True).reset_index(drop=True)
+        reference_slides = {reference: [] for reference in references}
+
+        # One pass over the contiguous corpus attributes every reference at once
+        if ahocorasick is not None:
+            automaton = ahocorasick.Automaton()
+            for reference in reference_slides:
+                automaton.add_word(reference, reference)
+            automaton.make_automaton()
+            matches = ((end - len(reference) + 1, reference) for end, reference in automaton.iter(self._corpus))
+        else:
+            matches = ((match.start(), match.group()) for match in REFERENCES_RE.finditer(self._corpus))
+
+        for position, reference in matches:
+            if reference in reference_slides:
+                slide_n = int(np.searchsorted(self._slide_offsets, position, side='right') - 1)
+                reference_slides[reference].append(slide_n)
+
+        for reference, slide_ns in reference_slides.items():
+            if slide_ns:
+                rows.extend((reference, slide_n) for slide_n in slide_ns)
+            else:
+                rows.append((reference, 'No slide number found'))
     
     def display_summary(self) -> None:
         """
         Function to display summarisation in terminal
         """
-        sum_list = [point for point in self.slide_summary.split('. ')]
-        
+        if self.slide_summary is None:
+            log.warning('No summarisation available to display')
+            return
+
         print('-------------------- SUMMARISATION START --------------------')
-        for n_point, point in enumerate(sum_list, start=1):
+        for n_point, point in enumerate(SENTENCE_SPLIT_RE.split(self.slide_summary), start=1):
             print(f'{n_point}. {point}')
         print('------------------------ REFERENCES -------------------------')
         print(self.references_df.to_string())
@@ -228,6 +522,7 @@ class SlidesIngest:
         """
         Sub-runner function for all summarisation processes
         """
+        self.load_sum_cache()
         self.summarise_all()
         self.get_references()
         
@@ -244,9 +539,13 @@ class SlidesIngest:
         log.info(f'Hello, Danielle. Current date: {self.today}')
         log.info(f'Starting PowerPoint summarisation on file: {self.pp_filename}')
         
-        self.init_summarisers()
-        self.load_file()
-        
+        # Model load is disk/GPU-bound and pptx parsing is CPU-bound, so overlap them
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            model_future = executor.submit(self.init_summarisers)
+            load_future = executor.submit(self.load_file)
+            model_future.result()
+            load_future.result()
+
         self.summarise_runner()
         
         if display: